@@ -7,9 +7,221 @@ Ben Ober-Reynolds
 20170331
 """
 
+import io
+import logging
+import pickle
+import sqlite3
+import asyncio
+import aiohttp
+import tenacity
+from lxml import etree
 from Bio import Entrez
-from pubmed_lookup import PubMedLookup, Publication
-from collections import OrderedDict
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+EUTILS_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/{}.fcgi'
+# Maximum number of eutils requests allowed in flight at once
+MAX_CONCURRENT_REQUESTS = 10
+# Maximum number of UIDs requested in a single efetch call
+EFETCH_BATCH_SIZE = 200
+# Maximum number of attempts made for a single eutils request
+MAX_REQUEST_ATTEMPTS = 5
+# Extra wait (seconds) before retrying a request NCBI rejected with 429
+RATE_LIMIT_PENALTY = 1.0
+
+
+# Fields extracted from a single 'PubmedArticle' element
+PubmedRecord = namedtuple('PubmedRecord', 
+    ['uid', 'title', 'journal', 'authors', 'url', 'abstract'])
+
+
+@dataclass
+class Publication:
+    # Lightweight summary of a pubmed article used for the scraper report
+    uid: str
+    title: str
+    url: str
+    journal: str
+    authors: str
+
+
+#####################################
+####### Retrying eutils calls #######
+#####################################
+
+_exponential_backoff = tenacity.wait_exponential_jitter(initial=0.5, max=8)
+
+
+def _retry_wait(retry_state):
+    # Exponential backoff with jitter, plus a penalty when NCBI reports 429 
+    # Too Many Requests
+    wait = _exponential_backoff(retry_state)
+    if getattr(retry_state.outcome.exception(), 'status', None) == 429:
+        wait += RATE_LIMIT_PENALTY
+    return wait
+
+
+def _retry_eutils(is_transient):
+    # Retry eutils failures for which is_transient(error) is true, 
+    # re-raising the last error if every attempt fails
+    return tenacity.retry(
+        stop=tenacity.stop_after_attempt(MAX_REQUEST_ATTEMPTS), 
+        wait=_retry_wait, 
+        retry=tenacity.retry_if_exception(is_transient), reraise=True)
+
+
+# Errors raised by an eutils call: failed requests, NCBI error responses
+# (RuntimeError) and truncated responses (XMLSyntaxError)
+_AEUTILS_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError, 
+    etree.XMLSyntaxError)
+
+
+def _is_transient_aeutils_error(error):
+    # HTTP errors are only worth retrying for 429 Too Many Requests and 5xx
+    # server errors; any other 4xx (e.g. a malformed term) fails every time
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, _AEUTILS_ERRORS)
+
+
+# Retries a whole eutils call, the request and the parsing of its response
+_retry_aeutils = _retry_eutils(_is_transient_aeutils_error)
+
+
+#########################################
+####### Asynchronous eutils calls #######
+#########################################
+
+# Everything needed to make eutils requests: an aiohttp.ClientSession and 
+# an (asyncio.Semaphore, asyncio.Lock) pair bounding the number of requests 
+# in flight and spacing out their start times
+EutilsClient = namedtuple('EutilsClient', ['session', 'limiter'])
+
+
+@asynccontextmanager
+async def open_eutils_client():
+    """
+    Open an EutilsClient. Every request made with the client shares its 
+    connection pool and rate limit, so a whole run should use one client.
+    Outputs:
+        An EutilsClient, closed when the context exits
+    """
+    limiter = (asyncio.Semaphore(MAX_CONCURRENT_REQUESTS), asyncio.Lock())
+    async with aiohttp.ClientSession() as session:
+        yield EutilsClient(session, limiter)
+
+
+def _run(coroutine_function, *args, **kwargs):
+    # Run coroutine_function(client, *args, **kwargs) to completion with a 
+    # client of its own. Used by the synchronous wrappers below.
+    async def run_with_client():
+        async with open_eutils_client() as client:
+            return await coroutine_function(client, *args, **kwargs)
+    return asyncio.run(run_with_client())
+
+
+def _request_interval():
+    # NCBI allows 3 requests per second, or 10 per second with an API key
+    return 0.1 if getattr(Entrez, 'api_key', None) else 1.0 / 3
+
+
+def _eutils_params(**params):
+    # Add the identifying parameters Bio.Entrez would normally send
+    params['tool'] = Entrez.tool
+    params['email'] = Entrez.email
+    params['api_key'] = getattr(Entrez, 'api_key', None)
+    return {key: value for key, value in params.items() if value is not None}
+
+
+async def _aeutils_request(client, utility, method='GET', **params):
+    """
+    Issue a single eutils request, respecting the NCBI rate limit
+    Inputs:
+        client (EutilsClient) - the client issuing the request
+        utility (str) - the eutils utility to call (e.g. 'esearch')
+        method (str) - 'GET' sends params in the url, 'POST' sends them in
+            the request body
+        params - query parameters for the utility
+    Outputs:
+        The raw response body (bytes)
+    """
+    params = _eutils_params(**params)
+    if method == 'POST':
+        request_kwargs = {'data': params}
+    else:
+        request_kwargs = {'params': params}
+    semaphore, pacing_lock = client.limiter
+    async with semaphore:
+        async with pacing_lock:
+            await asyncio.sleep(_request_interval())
+        async with client.session.request(method, EUTILS_URL.format(utility), 
+            **request_kwargs) as response:
+            response.raise_for_status()
+            return await response.read()
+
+
+def _parse_eutils_xml(body):
+    # Parse an eutils XML response, raising RuntimeError if NCBI reported 
+    # an error
+    root = etree.fromstring(body)
+    error = root.findtext('ERROR')
+    if error is not None:
+        raise RuntimeError(error)
+    return root
+
+
+@_retry_aeutils
+async def _aesearch(client, term, reldate, db='pubmed', sort='Most Recent', 
+    retmode='xml', retmax=20, datetype='edat'):
+    # esearch for a single term, returning the list of found UIDs
+    body = await _aeutils_request(client, 'esearch', db=db, sort=sort, 
+        retmode=retmode, retmax=retmax, term=term, reldate=reldate, 
+        datetype=datetype)
+    return [uid.text for uid in _parse_eutils_xml(body).iterfind('IdList/Id')]
+
+
+@_retry_aeutils
+async def _aepost(client, ID_list, db='pubmed'):
+    # epost a list of UIDs, returning their (webenv, query_key) history keys
+    body = await _aeutils_request(client, 'epost', method='POST', db=db, 
+        id=','.join(ID_list))
+    root = _parse_eutils_xml(body)
+    return root.findtext('WebEnv'), root.findtext('QueryKey')
+
+
+@_retry_aeutils
+async def _aefetch(client, ID=None, db='pubmed', retmode='xml', rettype='xml', 
+    retmax=20, webenv=None, query_key=None, retstart=0):
+    # efetch by ID or from the history server, returning a list of 
+    # PubmedRecords
+    body = await _aeutils_request(client, 'efetch', id=ID, db=db, 
+        retmode=retmode, rettype=rettype, retmax=retmax, webenv=webenv, 
+        query_key=query_key, retstart=None if ID is not None else retstart)
+    return list(parse_pubmed_articles(io.BytesIO(body)))
+
+
+async def _afetch_by_history(client, ID_list, db='pubmed', retmode='xml', 
+    rettype='xml', retmax=EFETCH_BATCH_SIZE):
+    # Upload ID_list to the history server with a single epost, then fetch
+    # the stored UIDs in concurrent pages of retmax records. Returns one
+    # list of PubmedRecords per page. A page that still fails after its 
+    # retries is logged and left empty, so it does not discard the others.
+    webenv, query_key = await _aepost(client, ID_list, db=db)
+
+    async def fetch_page(retstart):
+        try:
+            return await _aefetch(client, db=db, retmode=retmode, 
+                rettype=rettype, retmax=retmax, webenv=webenv, 
+                query_key=query_key, retstart=retstart)
+        except _AEUTILS_ERRORS as error:
+            logging.warning('Fetching records %d-%d of %d failed: %s', 
+                retstart + 1, min(retstart + retmax, len(ID_list)), 
+                len(ID_list), error)
+            return []
+    return await asyncio.gather(*[fetch_page(retstart) 
+        for retstart in range(0, len(ID_list), retmax)])
+
 
 ###################################
 ####### Searching functions #######
@@ -32,14 +244,57 @@ def entrezSearch(term, reldate, db='pubmed', sort='Most Recent',
     Outputs: 
         A list of found UIDs
     """
-    handle = Entrez.esearch(db=db, sort=sort, retmode=retmode, 
-            retmax=retmax, term=term, reldate=reldate, 
-            datetype=datetype)
-    return Entrez.read(handle)['IdList']
+    return _run(_aesearch, term, reldate, db=db, sort=sort, retmode=retmode, 
+        retmax=retmax, datetype=datetype)
+
+
+async def asearch_by_terms(client, labels, formatted_terms, reldate, 
+    database='pubmed', sort_type='Most Recent', retmax=20, datetype='edat'):
+    """
+    Perform entrez esearch for several terms concurrently. A failed search is
+    logged and treated as having no results, so the other searches still run.
+    Inputs:
+        client (EutilsClient) - the client issuing the requests
+        labels (list) - list of labels to key the results by, one per term
+        formatted_terms (list) - list of formatted search terms
+        reldate (int) - the number of days previously that define the max 
+            date range
+        database (str) - the database to query
+        sort_type (str) - the way to sort the results
+        retmax (int) - the maximum number of search results
+        datetype (str) - the date type (e.g. entrez date) relevant to the 
+            search
+    Outputs:
+        results_by_term (dict) - dictionary of UID lists keyed by label
+    """
+    async def search(term):
+        try:
+            return await _aesearch(client, term, reldate, db=database, 
+                sort=sort_type, retmax=retmax, datetype=datetype)
+        except _AEUTILS_ERRORS as error:
+            logging.warning("Search for '%s' failed: %s", term, error)
+            return []
+    return dict(zip(labels, 
+        await asyncio.gather(*[search(term) for term in formatted_terms])))
+
+
+def format_keyword_term(keyword):
+    # Format a keyword for a [Title/Abstract] search
+    return '+'.join(keyword.split()) + "[Title/Abstract]"
+
+
+def format_author_term(author):
+    # Format an author ('<Lastname> <Initials>') for an [Author] search
+    return author + '[Author]'
+
+
+def format_journal_term(journal, topic_list):
+    # Format a journal and its topics for a [Journal] search on any topic
+    return journal + '[Journal] AND ({})'.format(' OR '.join(topic_list))
 
 
 def search_by_keywords(keywords, reldate, database='pubmed', 
-    sort_type='Most Recent', retmax=20, datetype='edat'):
+    sort_type='Most Recent', retmax=20, datetype='edat', formatted_terms=None):
     """
     Query the Entrez pubmed database by a list of provided keywords. Uses the
     [Title/Abstract] search classifier
@@ -52,20 +307,20 @@ def search_by_keywords(keywords, reldate, database='pubmed',
         retmax (int) - the maximum number of search results
         datetype (str) - the date type (e.g. entrez date) relevant to the 
             search
+        formatted_terms (tuple) - optional pre-formatted search terms (see 
+            format_keyword_term), one per keyword
     Outputs:
         results_by_term (dict) - dictionary of UID lists keyed by search term
     """
-    results_by_term = OrderedDict()
-    for term in keywords:
-        formatted_term = '+'.join(term.split()) + "[Title/Abstract]"
-        results_by_term[term] = entrezSearch(db=database, sort=sort_type, 
-            retmode='xml', retmax=retmax, term=formatted_term, reldate=reldate, 
-            datetype=datetype)
-    return results_by_term
+    if formatted_terms is None:
+        formatted_terms = tuple(map(format_keyword_term, keywords))
+    return _run(asearch_by_terms, keywords, formatted_terms, reldate, 
+        database=database, sort_type=sort_type, retmax=retmax, 
+        datetype=datetype)
 
 
 def search_by_authors(authors, reldate, database='pubmed', 
-    sort_type='Most Recent', retmax=20, datetype='edat'):
+    sort_type='Most Recent', retmax=20, datetype='edat', formatted_terms=None):
     """
     Query the Entrez pubmed database by a list of provided authors.
     Inputs:
@@ -75,20 +330,20 @@ def search_by_authors(authors, reldate, database='pubmed',
         database (str) - the database to query
         sort_type (str) - the way to sort the results
         retmax (int) - the maximum number of search results
+        formatted_terms (tuple) - optional pre-formatted search terms (see 
+            format_author_term), one per author
     Outputs:
         results_by_term (dict) - dictionary of UID lists keyed by search term
     """
-    results_by_term = OrderedDict()
-    for term in authors:
-        formatted_term = term + '[Author]'
-        results_by_term[term] = entrezSearch(db=database, sort=sort_type, 
-            retmode='xml', retmax=retmax, term=formatted_term, reldate=reldate, 
-            datetype=datetype)
-    return results_by_term
+    if formatted_terms is None:
+        formatted_terms = tuple(map(format_author_term, authors))
+    return _run(asearch_by_terms, authors, formatted_terms, reldate, 
+        database=database, sort_type=sort_type, retmax=retmax, 
+        datetype=datetype)
 
 
 def search_by_journal_and_topic(journal_topic_dict, reldate, database='pubmed', 
-    sort_type='Most Recent', retmax=20, datetype='edat'):
+    sort_type='Most Recent', retmax=20, datetype='edat', formatted_terms=None):
     """
     Query the Entrez pubmed database by topics from a specific journal
         journal_topic_dict (dict) - dictionary of topics keyed by journal
@@ -97,117 +352,280 @@ def search_by_journal_and_topic(journal_topic_dict, reldate, database='pubmed',
         database (str) - the database to query
         sort_type (str) - the way to sort the results
         retmax (int) - the maximum number of search results
+        formatted_terms (tuple) - optional pre-formatted search terms (see 
+            format_journal_term), one per journal
     Outputs:
         results_by_term (dict) - dictionary of UID lists keyed by search term
     """
-    results_by_term = OrderedDict()
-    for journal, topic_list in journal_topic_dict.items():
-        formatted_term = journal + '[Journal] AND ({})'.format(' OR '.join(topic_list))
-        results_by_term[formatted_term] = entrezSearch(db=database, sort=sort_type, 
-            retmode='xml', retmax=retmax, term=formatted_term, reldate=reldate, 
-            datetype=datetype)
-    return results_by_term
+    if formatted_terms is None:
+        formatted_terms = tuple(format_journal_term(journal, topic_list) 
+            for journal, topic_list in journal_topic_dict.items())
+    return _run(asearch_by_terms, formatted_terms, formatted_terms, reldate, 
+        database=database, sort_type=sort_type, retmax=retmax, 
+        datetype=datetype)
 
 ##################################
 ####### Fetching functions #######
 ##################################
 
 def fetch_data_for_ID_list(ID_list, database='pubmed', retmode='xml', 
-    rettype='xml', retmax=20):
+    rettype='xml', retmax=EFETCH_BATCH_SIZE):
     """
-    Fetch data for a list of UIDs
+    Fetch data for a list of UIDs. The UIDs are uploaded to the entrez 
+    history server with a single epost, then fetched in pages of retmax 
+    records, with one efetch call per page. Pages that fail are logged and 
+    skipped.
     Inputs:
         ID_list (list) - a list of UIDs to search
         db (str) - the database to query
         retmode (str) - the retrieval mode
         rettype (str) - the retrieval type
-        retmax (int) - the maximum number of search results
+        retmax (int) - the maximum number of UIDs fetched per efetch call
     Outputs:
-        result_list (list) - list of 'Bio.Entrez.Parser.StructureElement'
-            objects
+        result_list (list) - list of PubmedRecords, one per fetched UID
     """
-    result_list = []
-    for ID in ID_list:
-        result_list.append(entrezFetch(ID, db=database, retmode=retmode, 
-            rettype=rettype, retmax=retmax))
-    return result_list
+    if not ID_list:
+        return []
+    pages = _run(_afetch_by_history, list(ID_list), db=database, 
+        retmode=retmode, rettype=rettype, retmax=retmax)
+    return [record for page in pages for record in page]
+
+
+def entrezPost(ID_list, db='pubmed'):
+    """
+    Upload a list of UIDs to the entrez history server
+    Inputs:
+        ID_list (list) - a list of UIDs to upload
+        db (str) - the database the UIDs belong to
+    Outputs:
+        (webenv, query_key) - history server keys for the uploaded UIDs
+    """
+    return _run(_aepost, ID_list, db=db)
 
 
-def entrezFetch(ID, db='pubmed', retmode='xml', rettype='xml', retmax=20):
+def entrezFetch(ID=None, db='pubmed', retmode='xml', rettype='xml', 
+    retmax=20, webenv=None, query_key=None, retstart=0):
     """
-    Perform entrez efetch using provided ID and settings
+    Perform entrez efetch using provided ID and settings. Records can be 
+    fetched either by ID or from the history server with webenv/query_key.
     Inputs:
-        ID (str) - the ID to search for
+        ID (str) - the ID to search for, or several comma-separated IDs
         db (str) - the database to query
         retmode (str) - the retrieval mode
         rettype (str) - the retrieval type
         retmax (int) - the maximum number of search results
+        webenv (str) - history server web environment (see entrezPost)
+        query_key (str) - history server query key (see entrezPost)
+        retstart (int) - index of the first history server record to fetch
+    Outputs:
+        A list of PubmedRecords
+    """
+    return _run(_aefetch, ID=ID, db=db, retmode=retmode, rettype=rettype, 
+        retmax=retmax, webenv=webenv, query_key=query_key, retstart=retstart)
+
+
+def parse_pubmed_articles(source):
+    """
+    Stream the articles in a 'PubmedArticleSet' XML document. Each article
+    element is discarded once its record has been extracted, so memory use
+    does not grow with the size of the document.
+    Inputs:
+        source (file or str) - binary file-like object or filename containing
+            the efetch XML
     Outputs:
-        A 'Bio.Entrez.Parser.StructureElement' object
+        A generator of PubmedRecords. Raises RuntimeError if the document is
+        an NCBI error response instead (e.g. an expired history server query)
     """
-    handle = Entrez.efetch(id=ID, db=db, retmode=retmode, rettype=rettype, 
-        retmax=retmax)
-    return Entrez.read(handle)
+    for _, elem in etree.iterparse(source, tag=('PubmedArticle', 'ERROR')):
+        if elem.tag == 'ERROR':
+            # Only a top-level <eFetchResult><ERROR> is an NCBI error
+            if elem.getparent().getparent() is None:
+                raise RuntimeError(elem.text)
+            continue
+        yield PubmedRecord(uid=get_uid(elem), title=get_title(elem), 
+            journal=get_journal(elem), authors=get_authors(elem), 
+            url=get_url(elem), abstract=get_abstract(elem))
+        # Free the finished article and any preceding siblings
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
 
 
-# or use the pubmed_lookup module I found after the fact...
-def fetch_pubs_from_ID_list(ID_list, entrez_email):
+async def afetch_pubs_from_ID_list(client, ID_list, database='pubmed', 
+    pub_cache=None):
     """
-    Fetch Publication objects for a list of UIDs
+    Fetch Publication objects for a list of UIDs. UIDs are posted to the 
+    entrez history server, then fetched in concurrent pages of 
+    EFETCH_BATCH_SIZE records.
     Inputs:
+        client (EutilsClient) - the client issuing the requests
         ID_list (list) - a list of UIDs to search
-        entrez_email (str) - the current entrez email
+        database (str) - the database to query
+        pub_cache (sqlite3.Connection) - optional publication cache (see 
+            open_pub_cache). Cached UIDs are not re-fetched, and newly 
+            fetched publications are added to the cache. Committing the 
+            cache is left to the caller.
     Outputs:
         result_list (list) - list of Publication
             objects
     """
-    result_list = []
-    for ID in ID_list:
-        lookup = PubMedLookup(ID, entrez_email)
-        # 20171011: It seems like there are some bad lookup results
-        # Adding this try/catch gets things working normally apparently...
-        try:
-            result_list.append(Publication(lookup))
-        except:
-            pass
+    pubs_by_uid = load_cached_pubs(pub_cache, ID_list) if pub_cache else {}
+    missing_IDs = [ID for ID in ID_list if ID not in pubs_by_uid]
+    fetched_pubs = await _afetch_pubs(client, missing_IDs, database)
+    if pub_cache:
+        store_cached_pubs(pub_cache, fetched_pubs)
+    pubs_by_uid.update((pub.uid, pub) for pub in fetched_pubs)
+    return [pubs_by_uid[ID] for ID in ID_list if ID in pubs_by_uid]
+
+
+def fetch_pubs_from_ID_list(ID_list, database='pubmed', pub_cache=None):
+    """
+    Synchronous version of afetch_pubs_from_ID_list, using a client of its
+    own
+    """
+    return _run(afetch_pubs_from_ID_list, ID_list, database=database, 
+        pub_cache=pub_cache)
+
+
+async def _afetch_pubs(client, ID_list, database='pubmed'):
+    # Fetch Publication objects for a list of UIDs from NCBI. Failures are 
+    # logged by UID; since failed UIDs are not cached, they are retried on 
+    # the next run
+    if not ID_list:
+        return []
+    try:
+        pages = await _afetch_by_history(client, list(ID_list), db=database)
+    except _AEUTILS_ERRORS as error:
+        logging.warning('Posting %d UIDs failed: %s', len(ID_list), error)
+        pages = []
+    result_list = [build_publication(record) 
+        for page in pages for record in page]
+    fetched_IDs = {pub.uid for pub in result_list}
+    missing_IDs = [ID for ID in ID_list if ID not in fetched_IDs]
+    if missing_IDs:
+        logging.warning('No publication fetched for UIDs: %s', 
+            ', '.join(missing_IDs))
     return result_list
 
 
+def build_publication(record):
+    """
+    Build a Publication from a single pubmed article record
+    Inputs:
+        record (PubmedRecord) - a parsed 'PubmedArticle'
+    Outputs:
+        A Publication object
+    """
+    return Publication(uid=record.uid, title=record.title, url=record.url, 
+        journal=record.journal, authors=record.authors)
+
+
+
+#################################
+####### Publication cache #######
+#################################
+
+def open_pub_cache(cache_file):
+    """
+    Open (creating if necessary) an sqlite cache of previously fetched 
+    publications, keyed by UID
+    Inputs:
+        cache_file (str) - filename for the sqlite database
+    Outputs:
+        A sqlite3.Connection to the cache
+    """
+    pub_cache = sqlite3.connect(cache_file)
+    pub_cache.execute('PRAGMA journal_mode=WAL')
+    pub_cache.execute('CREATE TABLE IF NOT EXISTS publications '
+        '(uid TEXT PRIMARY KEY, record BLOB NOT NULL)')
+    return pub_cache
+
+
+def load_cached_pubs(pub_cache, ID_list):
+    """
+    Look up previously fetched publications in the cache
+    Inputs:
+        pub_cache (sqlite3.Connection) - the publication cache
+        ID_list (list) - a list of UIDs to look up
+    Outputs:
+        pubs_by_uid (dict) - dictionary of cached Publications keyed by UID
+    """
+    pubs_by_uid = {}
+    for ID in ID_list:
+        row = pub_cache.execute('SELECT record FROM publications WHERE uid = ?', 
+            (ID,)).fetchone()
+        if row is not None:
+            pubs_by_uid[ID] = Publication(ID, *pickle.loads(row[0]))
+    return pubs_by_uid
+
+
+def store_cached_pubs(pub_cache, pub_list):
+    """
+    Add publications to the cache. Changes are not committed.
+    Inputs:
+        pub_cache (sqlite3.Connection) - the publication cache
+        pub_list (list) - list of Publication objects to store
+    """
+    pub_cache.executemany('INSERT OR REPLACE INTO publications VALUES (?, ?)', 
+        [(pub.uid, pickle.dumps((pub.title, pub.url, pub.journal, pub.authors))) 
+            for pub in pub_list])
+
+
 
 ###################################
 ####### Information Getters #######
 ###################################
 
-# No longer necessary with pubmed_lookup module...
+# All getters operate on a single 'PubmedArticle' lxml element, using 
+# XPath expressions compiled once at import
+
+def _compile_xpath(path):
+    # Compile an XPath relative to a 'PubmedArticle' element
+    return etree.XPath(path, smart_strings=False)
+
+# string() includes the text of any inline markup (e.g. <i>) in titles
+_XP_UID = _compile_xpath('string(./MedlineCitation/PMID)')
+_XP_TITLE = _compile_xpath('string(./MedlineCitation/Article/ArticleTitle)')
+_XP_JOURNAL = _compile_xpath('string(./MedlineCitation/Article/Journal/Title)')
+# Collective authors have no LastName and are skipped
+_XP_AUTHORS = _compile_xpath(
+    './MedlineCitation/Article/AuthorList/Author[LastName]')
+_XP_DOI = _compile_xpath(
+    'string(./MedlineCitation/Article/ELocationID[@EIdType="doi"])')
+_XP_ABSTRACT = _compile_xpath(
+    'string(./MedlineCitation/Article/Abstract/AbstractText[1])')
 
-def get_title(data_record):
+
+def get_uid(article):
+    # Get the pubmed UID of a pubmed article
+    return _XP_UID(article)
+
+
+def get_title(article):
     # Get the article title from a pubmed article
-    return data_record['PubmedArticle'][0]['MedlineCitation']['Article']['ArticleTitle']
+    return _XP_TITLE(article)
 
 
-def get_journal(data_record):
+def get_journal(article):
     # Get the journal title from a pubmed article
-    return data_record['PubmedArticle'][0]['MedlineCitation']['Article']['Journal']['Title']
+    return _XP_JOURNAL(article)
 
 
-def get_authors(data_record):
-    # Get an author list from a pubmed article
-    author_list = []
-    # The data record contains lots of information about each author
-    for author in data_record['PubmedArticle'][0]['MedlineCitation']['Article']['AuthorList']:
-        author_list.append(author['LastName'] + ' ' + author['Initials'])
-    return author_list
+def get_authors(article):
+    # Get the comma-separated author list from a pubmed article
+    return ', '.join(' '.join(filter(None, (author.findtext('LastName'), 
+        author.findtext('Initials')))) for author in _XP_AUTHORS(article))
 
 
-def get_url(data_record):
+def get_url(article):
     # Get the article url from a pubmed article
-    url_tail = ''
-    for elocation in data_record['PubmedArticle'][0]['MedlineCitation']['Article']['ELocationID']:
-        # Only elocations that are 'doi' format can be easily linked to currently
-        if elocation.attributes['EIdType'] == 'doi':
-            url_tail = str(elocation)
-    return 'dx.doi.org/' + url_tail
-
-def get_abstract(data_record):
+    # Only elocations that are 'doi' format can be easily linked to currently
+    doi = _XP_DOI(article)
+    if doi:
+        return 'https://dx.doi.org/' + doi
+    # Fall back on the pubmed page for the article
+    return 'https://www.ncbi.nlm.nih.gov/pubmed/' + get_uid(article)
+
+def get_abstract(article):
     # Get the abstract from a pubmed article
-    return data_record['PubmedArticle'][0]['MedlineCitation']['Article']['Abstract']['AbstractText'][0]
+    return _XP_ABSTRACT(article)
@@ -13,18 +13,26 @@ Ben Ober-Reynolds
 20170331
 """
 
+import io
 import os
+import asyncio
 import sys
 import argparse
 import entrezUtils
 import smtplib
-from pubmed_lookup import PubMedLookup, Publication
-from collections import OrderedDict
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from datetime import date
 from Bio import Entrez
 
+# html templates for the report body
+SECTION_FMT = '<h2 style="color:red;">{section}</h2>\n'
+TERM_FMT = '<h4>{term}</h4>\n'
+NO_RESULTS_FMT = "<p>No results for '{term}' in the last {pub_days_ago} days</p>\n"
+PUB_FMT = ('<p><a href="{url}"> <b>{title}</b> </a></p>\n'
+    '<p><i>{journal}</i></p>\n'
+    '<p>{authors}</p>\n')
+
 
 
 def main():  
@@ -34,6 +42,9 @@ def main():
     group.add_argument('-sf', '--search_file', required=True,
         help='File containing settings and search terms')
     group = parser.add_argument_group('optional arguments')
+    group.add_argument('-cf', '--cache_file', 
+        help='sqlite file used to cache fetched publications between runs '
+        '(default: pub_scraper_cache.sqlite next to the search file)')
 
     # print help if no arguments provided
     if len(sys.argv) <= 1:
@@ -56,6 +67,9 @@ def main():
     settings_dict = parse_search_file(args.search_file)
     
     entrez_email = settings_dict['entrez_email_address'][0]
+    # An API key is optional, but raises the NCBI rate limit from 3 to 10
+    # requests per second
+    entrez_api_key = (settings_dict.get('entrez_api_key') or [None])[0]
     send_to_emails = settings_dict['send_to_email_address']
     search_keywords = settings_dict['search_keywords']
     search_authors = settings_dict['search_authors']
@@ -64,37 +78,47 @@ def main():
     sender_email = settings_dict['sender_email'][0]
     sender_pswd = settings_dict['sender_pswd'][0]
 
-    # Parse journal_topic_list:
+    # Parse journal_topic_list, formatting each journal's search term once:
     journal_topic_dict = parse_journal_topics(journal_topic_list)
+    formatted_journal_terms = tuple(entrezUtils.format_journal_term(journal, 
+        topic_list) for journal, topic_list in journal_topic_dict.items())
 
-    # Set entrez email:
+    # Set entrez email and API key:
     Entrez.email = entrez_email
-
-    # Search by keywords:
-    keyword_results = entrezUtils.search_by_keywords(search_keywords, 
-        reldate=pub_days_ago, database=database, sort_type=sort_type)
-
-    # Search by authors:
-    author_results = entrezUtils.search_by_authors(search_authors, 
-        reldate=pub_days_ago, database=database, sort_type=sort_type)
-
-    # Search by journal plus topics:
-    journal_topic_results = entrezUtils.search_by_journal_and_topic(
-        journal_topic_dict, reldate=pub_days_ago, database=database, 
-        sort_type=sort_type)
-    
-    # Fetch data records for identified UIDs
-    keyword_publications = build_result_dict(keyword_results, database)
-    author_publications = build_result_dict(author_results, database)
+    Entrez.api_key = entrez_api_key
+
+    # Open the publication cache:
+    cache_file = args.cache_file
+    if cache_file is None:
+        cache_file = os.path.join(os.path.dirname(os.path.abspath(
+            args.search_file)), 'pub_scraper_cache.sqlite')
+    pub_cache = entrezUtils.open_pub_cache(cache_file)
+
+    # Run every search, then fetch the publications found, in a single 
+    # eutils session:
+    search_groups = [
+        (search_keywords, settings_dict['formatted_search_keywords']),
+        (search_authors, settings_dict['formatted_search_authors']),
+        (formatted_journal_terms, formatted_journal_terms)
+    ]
+    search_results, pubs_by_uid = asyncio.run(search_and_fetch(search_groups, 
+        pub_days_ago, database, sort_type, pub_cache))
+    keyword_results, author_results, journal_topic_results = search_results
+    # Newly fetched publications are saved in a single transaction
+    pub_cache.commit()
+    pub_cache.close()
+
+    keyword_publications = build_result_dict(keyword_results, pubs_by_uid)
+    author_publications = build_result_dict(author_results, pubs_by_uid)
     journal_topic_publications = build_result_dict(journal_topic_results, 
-        database)
+        pubs_by_uid)
     
     # All results:
-    all_results_dict = OrderedDict([
-        ('Keyword Searches', keyword_publications),
-        ('Author Searches', author_publications),
-        ('Journal and Topic Searches', journal_topic_publications)
-    ])
+    all_results_dict = {
+        'Keyword Searches': keyword_publications,
+        'Author Searches': author_publications,
+        'Journal and Topic Searches': journal_topic_publications
+    }
 
     # Get the total number of hits:
     total_hits = 0
@@ -115,13 +139,12 @@ def main():
 
     # Actually send the email:
     try:
-        server = smtplib.SMTP_SSL(email_server, smtp_port)
-        server.ehlo()
-        server.login(sender_email, sender_pswd)
-        server.sendmail(sender_email, send_to_emails, message.as_string())
-        server.quit()
-    except:
-        print("email failed to send")
+        with smtplib.SMTP_SSL(email_server, smtp_port) as server:
+            server.login(sender_email, sender_pswd)
+            server.send_message(message, from_addr=sender_email, 
+                to_addrs=send_to_emails)
+    except (smtplib.SMTPException, OSError) as error:
+        print("email failed to send: {}".format(error))
 
 
 
@@ -138,27 +161,32 @@ def parse_search_file(search_file):
     settings_dict = {}
 
     with open(search_file, 'r') as f:
-        for line in f:
-            # The '#' character denotes a line that should be ignored in the 
-            # settings file
-            if line[0] == '#':
-                continue
-            # The '$' character denotes a setting header line-- every line
-            # following the header line is added to that header's list in the
-            # settings_dict
-            if line[0] == '$':
-                key = line.strip().split()[1]
-                settings_dict[key] = []
-                while True:
-                    try:
-                        line = f.readline().strip()
-                        if line[0] == '#':
-                            continue
-                        if line == '':
-                            break
-                        settings_dict[key].append(line)
-                    except EOFError:
-                        break
+        lines = [line.strip() for line in f]
+
+    # The setting that lines are currently being added to (if any)
+    current_key = None
+    for line in lines:
+        # The '#' character denotes a line that should be ignored in the 
+        # settings file
+        if line.startswith('#'):
+            continue
+        # A blank line ends the current setting
+        if not line:
+            current_key = None
+        # The '$' character denotes a setting header line-- every line
+        # following the header line is added to that header's list in the
+        # settings_dict
+        elif line.startswith('$'):
+            current_key = line.split()[1]
+            settings_dict[current_key] = []
+        elif current_key is not None:
+            settings_dict[current_key].append(line)
+
+    # Format the search terms once, storing them alongside the raw lists
+    settings_dict['formatted_search_keywords'] = tuple(map(
+        entrezUtils.format_keyword_term, settings_dict.get('search_keywords', [])))
+    settings_dict['formatted_search_authors'] = tuple(map(
+        entrezUtils.format_author_term, settings_dict.get('search_authors', [])))
 
     return settings_dict
 
@@ -171,28 +199,62 @@ def parse_journal_topics(journal_topic_list):
     Outputs:
         journal_topic_dict (dict) - dictionary of topics keyed by journal
     """
-    journal_topic_dict = OrderedDict()
+    journal_topic_dict = {}
     for jt_list in journal_topic_list:
         journal, topic_list = jt_list.split('=')
-        journal_topic_dict[journal] = topic_list.strip()[1:-1].split(',')
+        journal_topic_dict[journal.strip()] = [topic.strip() 
+            for topic in topic_list.strip()[1:-1].split(',')]
     return journal_topic_dict
 
 
-def build_result_dict(search_dict, entrez_email):
+async def search_and_fetch(search_groups, pub_days_ago, database, sort_type, 
+    pub_cache=None):
+    """
+    Run every search, then fetch the publications they found. All requests 
+    share one eutils client, and each UID is fetched once, even if it was 
+    found by several searches.
+    Inputs:
+        search_groups (list) - list of (labels, formatted search terms) pairs,
+            one per group of searches
+        pub_days_ago (int) - day range for checking on new pubs
+        database (str) - the database to query
+        sort_type (str) - the way to sort the results
+        pub_cache (sqlite3.Connection) - optional cache of previously fetched
+            publications
+    Output:
+        search_results (list) - list of dictionaries of UID lists keyed by 
+            label, one per search group
+        pubs_by_uid (dict) - dictionary of fetched publications keyed by UID
+    """
+    async with entrezUtils.open_eutils_client() as client:
+        search_results = await asyncio.gather(*[entrezUtils.asearch_by_terms(
+            client, labels, formatted_terms, pub_days_ago, database=database, 
+            sort_type=sort_type) for labels, formatted_terms in search_groups])
+        unique_UIDs = list(dict.fromkeys(UID 
+            for search_dict in search_results 
+            for UID_list in search_dict.values() 
+            for UID in UID_list))
+        pub_list = await entrezUtils.afetch_pubs_from_ID_list(client, 
+            unique_UIDs, database=database, pub_cache=pub_cache)
+    return search_results, {pub.uid: pub for pub in pub_list}
+
+
+def build_result_dict(search_dict, pubs_by_uid):
     """
     Build a dictionary of data records based on previously identified UIDs
     Inputs:
         search_dict (dict) - dictionary of previously identified UIDs keyed by 
             search term
-        entrez_email (str) - the current entrez email
+        pubs_by_uid (dict) - dictionary of already fetched publications keyed
+            by UID
     Output:
         data_dict (dict) - dictionary of publications corresponding to the 
             previously identified UIDs
     """
-    data_dict = OrderedDict()
+    data_dict = {}
     for key, UID_list in search_dict.items():
-        data_dict[key] = entrezUtils.fetch_pubs_from_ID_list(UID_list, 
-            entrez_email)
+        data_dict[key] = [pubs_by_uid[UID] for UID in UID_list 
+            if UID in pubs_by_uid]
     return data_dict
 
 
@@ -214,34 +276,31 @@ def construct_email_body(all_results_dict, pub_days_ago):
     <h1><b>Pub Scraper Report</b></h1>
     <br/>
     """
+    # Define the tail:
+    html_tail = """\
+    </body>
+    </html>
+    """
     # Fill in html body:
-    report_sections = []
-    for section, result_dict in all_results_dict.items():
-        report_subsection = ['<h2 style="color:red;">{}</h2>\n'.format(section)]
+    html_buffer = io.StringIO()
+    html_buffer.write(html_header + '\n')
+    for section_number, (section, result_dict) in enumerate(
+        all_results_dict.items()):
+        # Sections are separated by a line break
+        if section_number > 0:
+            html_buffer.write('<br/>')
+        html_buffer.write(SECTION_FMT.format(section=section))
         for term, pub_list in result_dict.items():
-            report_subsection.append("<h4>{}</h4>\n".format(term))
+            html_buffer.write(TERM_FMT.format(term=term))
             if len(pub_list) < 1:
-                report_subsection.append(
-                    "<p>No results for '{}' in the last {} days</p>\n".format(
-                        term, pub_days_ago))
+                html_buffer.write(NO_RESULTS_FMT.format(term=term, 
+                    pub_days_ago=pub_days_ago))
                 continue
             for pub in pub_list:
                 # Format for html
-                report_subsection.append(
-                    '<p><a href="{}"> <b>{}</b> </a></p>\n'.format(
-                        pub.url, pub.title))
-                report_subsection.append("<p><i>{}</i></p>\n".format(
-                    pub.journal))
-                report_subsection.append("<p>{}</p>\n".format(
-                    pub.authors))
-        report_sections.append(''.join(report_subsection))
-    html_body = '<br/>'.join(report_sections)
-    # Define the tail:
-    html_tail = """\
-    </body>
-    </html>
-    """
-    return '\n'.join([html_header, html_body, html_tail])
+                html_buffer.write(PUB_FMT.format_map(vars(pub)))
+    html_buffer.write('\n' + html_tail)
+    return html_buffer.getvalue()
 
 
 if __name__ == '__main__':